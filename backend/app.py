@@ -3,28 +3,111 @@ MindMate Backend - Flask API for AI Chat Support
 Integrates with Google Gemini API for empathetic student wellbeing support
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+import atexit
+import logging
+import logging.handlers
 import os
+import queue
 import google.generativeai as genai
+from google.api_core import retry as api_retry
 from datetime import datetime
+import hashlib
 import re
+import threading
+import time
+from types import MappingProxyType
+import orjson
+from cachetools import TTLCache
 from dotenv import load_dotenv
 
+try:
+    import hyperscan
+except ImportError:  # hyperscan is optional and needs the native libhs
+    hyperscan = None
+
+try:
+    import ahocorasick
+except ImportError:  # pyahocorasick is optional; fall back to a compiled regex
+    ahocorasick = None
+
+__all__ = [
+    "app",
+    "SYSTEM_PROMPT",
+    "DISTRESS_KEYWORDS",
+    "detect_distress",
+    "generate_safety_warning",
+    "call_gemini_api",
+    "stream_gemini_api",
+    "GeminiStreamError",
+]
+
 # Load environment variables from .env file
 load_dotenv()
 
+# Log through a queue so request threads never block on writing to stdout
+logger = logging.getLogger("mindmate")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_log_queue = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+# The listener thread does not survive fork (gunicorn --preload): flush it before
+# forking and start a fresh one on both sides
+os.register_at_fork(
+    before=_log_listener.stop,
+    after_in_parent=_log_listener.start,
+    after_in_child=_log_listener.start
+)
+
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider that encodes and decodes with orjson"""
+
+    mimetype = "application/json"
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response instead of round-tripping through str
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype=self.mimetype)
+
+
 # Initialize Flask app
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)  # Enable CORS for frontend requests
+
+# Longest message accepted by /chat, and the request body cap that goes with it.
+# Werkzeug rejects larger bodies with 413 before they are read or parsed. The cap
+# is sized for the escaped worst case: encoders with ensure_ascii (including
+# requests' json=) write each non-BMP character such as an emoji as a 12-byte
+# \uXXXX\uXXXX pair, so 5000 of them take 60,000 bytes plus the rest of the payload.
+MAX_MESSAGE_LENGTH = 5000
+app.config["MAX_CONTENT_LENGTH"] = 64 * 1024
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-print("GEMINI_API_KEY loaded:", bool(GEMINI_API_KEY))
+logger.info("GEMINI_API_KEY loaded: %s", bool(GEMINI_API_KEY))
 
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-    gemini_model = genai.GenerativeModel("models/gemini-flash-latest")
-else:
-    gemini_model = None
+# Exact-match cache of Gemini replies, keyed on a digest of the user message
+GEMINI_CACHE_SIZE = 4096
+GEMINI_CACHE_TTL = 3600  # seconds
+_gemini_cache = TTLCache(maxsize=GEMINI_CACHE_SIZE, ttl=GEMINI_CACHE_TTL)
+_gemini_cache_lock = threading.Lock()
+_gemini_inflight = {}  # cache key -> Event set when the Gemini call finishes
+
+UNAVAILABLE_REPLY = "AI support is temporarily unavailable. Please try again later 💙"
+ERROR_REPLY = "I'm having trouble responding right now. Please try again later 💙"
 
 
 # System prompt that defines MindMate's behavior
@@ -65,15 +148,85 @@ When distress is detected: Acknowledge their pain, suggest professional help, an
 
 Keep responses concise (2-3 sentences) unless more detail is needed. Be genuine."""
 
-# List of distress keywords to detect severe emotional states
-DISTRESS_KEYWORDS = [
+# Text around the user's message; SYSTEM_PROMPT is sent as the model's
+# system instruction so it stays a stable prefix Gemini can cache
+_PROMPT_PREFIX = "User says: "
+_PROMPT_SUFFIX = "\n\nRespond as MindMate:"
+
+# Safe to build before gunicorn forks: the SDK opens its connection on the first
+# request, so each worker gets its own
+if GEMINI_API_KEY:
+    genai.configure(api_key=GEMINI_API_KEY)
+    gemini_model = genai.GenerativeModel(
+        "models/gemini-flash-latest",
+        system_instruction=SYSTEM_PROMPT
+    )
+else:
+    gemini_model = None
+
+# Keep failing Gemini calls from holding a worker thread. Each blocking attempt
+# times out after GEMINI_TIMEOUT seconds, and transient errors are retried only
+# while under GEMINI_RETRY_DEADLINE. An attempt started just before that deadline
+# still gets its full timeout, so a blocking call can take up to ~18 s in total.
+GEMINI_TIMEOUT = 8  # seconds per attempt
+GEMINI_RETRY_DEADLINE = 10  # seconds before no new attempt is started
+_GEMINI_REQUEST_OPTIONS = {
+    "timeout": GEMINI_TIMEOUT,
+    "retry": api_retry.Retry(
+        initial=0.5,
+        maximum=2.0,
+        multiplier=2.0,
+        timeout=GEMINI_RETRY_DEADLINE
+    )
+}
+
+# A streaming timeout is a deadline for the whole stream, not per attempt, so
+# streamed replies get a longer bound. Retry is switched off explicitly: the SDK
+# otherwise applies its own default retry (up to 600 s on 503s) to stream startup,
+# and a retry after partial output would resend text the client already has.
+# With one attempt, a streamed reply holds its worker for at most ~60 s.
+GEMINI_STREAM_TIMEOUT = 60  # seconds for the entire streamed reply
+_GEMINI_STREAM_REQUEST_OPTIONS = {"timeout": GEMINI_STREAM_TIMEOUT, "retry": None}
+
+# Distress keywords to detect severe emotional states; a tuple, since the
+# matchers below are compiled from it once at import and must not drift
+DISTRESS_KEYWORDS = (
     "suicide", "self-harm", "kill myself", "end it all", "no point",
     "hopeless", "worthless", "can't take it", "nobody cares", "alone forever",
     "scared", "panic", "terrified", "panic attack", "anxiety attack",
     "abusive", "abuse", "assault", "harassed", "bullied",
     "drug", "drugs", "alcohol", "drinking", "high", "drunk",
     "depressed", "depression", "suicidal", "die"
-]
+)
+
+# Hyperscan database over DISTRESS_KEYWORDS for high-QPS deployments; scans
+# share one scratch space, so they are serialized with a lock
+if hyperscan is not None:
+    _DISTRESS_HS = hyperscan.Database()
+    _DISTRESS_HS.compile(
+        expressions=[re.escape(keyword).encode() for keyword in DISTRESS_KEYWORDS],
+        ids=list(range(len(DISTRESS_KEYWORDS))),
+        flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SINGLEMATCH] * len(DISTRESS_KEYWORDS)
+    )
+    _distress_hs_lock = threading.Lock()
+else:
+    _DISTRESS_HS = None
+
+# Aho-Corasick automaton over DISTRESS_KEYWORDS, built once at import so
+# detect_distress scans the message in a single pass instead of once per keyword
+if ahocorasick is not None:
+    _DISTRESS_AC = ahocorasick.Automaton()
+    for _keyword in DISTRESS_KEYWORDS:
+        _DISTRESS_AC.add_word(_keyword, _keyword)
+    _DISTRESS_AC.make_automaton()
+else:
+    _DISTRESS_AC = None
+
+# Single case-insensitive alternation used when the automaton is unavailable
+_DISTRESS_RE = re.compile(
+    "|".join(re.escape(keyword) for keyword in DISTRESS_KEYWORDS),
+    re.IGNORECASE
+)
 
 
 def detect_distress(message):
@@ -81,43 +234,228 @@ def detect_distress(message):
     Check if the message contains indicators of severe distress
     Returns True if distress is detected
     """
-    message_lower = message.lower()
-    for keyword in DISTRESS_KEYWORDS:
-        if keyword in message_lower:
-            return True
-    return False
+    if _DISTRESS_HS is not None:
+        matches = []
+        with _distress_hs_lock:
+            _DISTRESS_HS.scan(
+                message.encode(),
+                match_event_handler=lambda *match: matches.append(match)
+            )
+        return bool(matches)
+    if _DISTRESS_AC is not None:
+        # The automaton is case-sensitive, so it needs the lowered copy
+        return next(_DISTRESS_AC.iter(message.lower()), None) is not None
+    # IGNORECASE matches the str directly; encoding to bytes would copy it just the same
+    return _DISTRESS_RE.search(message) is not None
+
+
+# Crisis support message, built once and shared read-only across requests
+_SAFETY_WARNING = MappingProxyType({
+    "warning": True,
+    "message": "I'm concerned about what you're sharing. Please reach out to a trusted adult, school counselor, or a mental health professional. Your wellbeing truly matters. 💙",
+    "resources": (
+        "Talk to your college counseling center",
+        "National Suicide Prevention Lifeline: 988 (US)",
+        "Crisis Text Line: Text HOME to 741741",
+        "International Association for Suicide Prevention: https://www.iasp.info/resources/Crisis_Centres/"
+    )
+})
 
 
 def generate_safety_warning():
-    """Generate a crisis support message"""
-    return {
-        "warning": True,
-        "message": "I'm concerned about what you're sharing. Please reach out to a trusted adult, school counselor, or a mental health professional. Your wellbeing truly matters. 💙",
-        "resources": [
-            "Talk to your college counseling center",
-            "National Suicide Prevention Lifeline: 988 (US)",
-            "Crisis Text Line: Text HOME to 741741",
-            "International Association for Suicide Prevention: https://www.iasp.info/resources/Crisis_Centres/"
-        ]
-    }
+    """Get the crisis support message (read-only)"""
+    return _SAFETY_WARNING
 
-def call_gemini_api(user_message):
-    if gemini_model is None:
-        return "AI support is temporarily unavailable. Please try again later 💙"
+def _cache_key(user_message):
+    """Fixed-size cache key so long messages are not kept in memory"""
+    return hashlib.blake2b(user_message.encode(), digest_size=16).digest()
+
+
+def _build_prompt(user_message):
+    """Frame the user's message for Gemini (the system prompt is sent separately)"""
+    return _PROMPT_PREFIX + user_message + _PROMPT_SUFFIX
 
+
+def _generate_reply(user_message):
+    """Call Gemini once; returns None if the request fails"""
     try:
-        full_message = (
-            f"{SYSTEM_PROMPT}\n\n"
-            f"User says: {user_message}\n\n"
-            f"Respond as MindMate:"
+        full_message = _build_prompt(user_message)
+        response = gemini_model.generate_content(
+            full_message,
+            request_options=_GEMINI_REQUEST_OPTIONS
         )
-
-        response = gemini_model.generate_content(full_message)
         return response.text.strip()
 
+    except Exception:
+        logger.exception("Gemini error")
+        return None
+
+
+def call_gemini_api(user_message, use_cache=True):
+    """
+    Get a MindMate reply from Gemini
+    Replies are cached per message unless use_cache is False, and
+    concurrent requests for the same message share a single Gemini call
+    """
+    if gemini_model is None:
+        return UNAVAILABLE_REPLY
+
+    if not use_cache:
+        return _generate_reply(user_message) or ERROR_REPLY
+
+    key = _cache_key(user_message)
+    with _gemini_cache_lock:
+        reply = _gemini_cache.get(key)
+        if reply is not None:
+            return reply
+        pending = _gemini_inflight.get(key)
+        is_leader = pending is None
+        if is_leader:
+            pending = _gemini_inflight[key] = threading.Event()
+
+    if not is_leader:
+        # Another request is already asking Gemini the same thing
+        pending.wait()
+        with _gemini_cache_lock:
+            reply = _gemini_cache.get(key)
+        return reply or ERROR_REPLY
+
+    try:
+        reply = _generate_reply(user_message)
+        if reply is not None:
+            with _gemini_cache_lock:
+                _gemini_cache[key] = reply
+    finally:
+        with _gemini_cache_lock:
+            del _gemini_inflight[key]
+        pending.set()
+
+    return reply or ERROR_REPLY
+
+
+# Finish reasons that mean a streamed reply is still going or ended normally;
+# anything else (SAFETY, MAX_TOKENS, ...) cuts the reply short
+_STREAM_OK_FINISH_REASONS = (
+    genai.protos.Candidate.FinishReason.FINISH_REASON_UNSPECIFIED,
+    genai.protos.Candidate.FinishReason.STOP
+)
+
+
+class GeminiStreamError(Exception):
+    """Gemini failed after part of a streamed reply had already been sent"""
+
+
+def stream_gemini_api(user_message, use_cache=True):
+    """
+    Yield a MindMate reply from Gemini chunk by chunk as it is generated
+    A complete streamed reply is stored in the same cache as call_gemini_api
+    Raises GeminiStreamError if Gemini fails mid-reply, so the partial text
+    is never followed by the fallback message as if it were one reply
+    """
+    if gemini_model is None:
+        yield UNAVAILABLE_REPLY
+        return
+
+    key = _cache_key(user_message) if use_cache else None
+    if key is not None:
+        with _gemini_cache_lock:
+            cached = _gemini_cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+    chunks = []
+    try:
+        response = gemini_model.generate_content(
+            _build_prompt(user_message),
+            stream=True,
+            request_options=_GEMINI_STREAM_REQUEST_OPTIONS
+        )
+        for chunk in response:
+            if not chunk.candidates:
+                # Usage-only chunks carry no candidate; a blocked prompt sets block_reason
+                if chunk.prompt_feedback.block_reason:
+                    raise ValueError(f"Gemini blocked the prompt: {chunk.prompt_feedback.block_reason.name}")
+                continue
+            candidate = chunk.candidates[0]
+            # Read the parts directly: chunk.text raises on a final chunk that has
+            # a finish reason but no parts
+            text = "".join(part.text for part in candidate.content.parts)
+            if text:
+                chunks.append(text)
+                yield text
+            if candidate.finish_reason not in _STREAM_OK_FINISH_REASONS:
+                raise ValueError(f"Gemini stopped early: {candidate.finish_reason.name}")
+
+        if not chunks:
+            raise ValueError("Gemini returned an empty reply")
+
     except Exception as e:
-        print("Gemini error:", e)
-        return "I'm having trouble responding right now. Please try again later 💙"
+        logger.exception("Gemini error")
+        if chunks:
+            raise GeminiStreamError(ERROR_REPLY) from e
+        yield ERROR_REPLY
+        return
+
+    if key is not None and chunks:
+        with _gemini_cache_lock:
+            _gemini_cache[key] = "".join(chunks).strip()
+
+
+def _sse_event(payload):
+    """Format a payload as a server-sent event frame"""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
+def _read_chat_message():
+    """
+    Pull the user's message out of a /chat request body
+    Returns (message, None) or (None, error_response)
+    """
+    try:
+        data = orjson.loads(request.get_data(cache=False) or b"{}")
+    except orjson.JSONDecodeError:
+        data = None
+
+    user_message = data.get("message") if isinstance(data, dict) else None
+
+    # Also covers malformed JSON, non-object bodies and non-string messages
+    if not isinstance(user_message, str):
+        return None, (jsonify({
+            "reply": "Please enter a message so I can help you 💙",
+            "warning": False
+        }), 400)
+
+    user_message = user_message.strip()
+
+    if not user_message:
+        return None, (jsonify({
+            "reply": "I didn’t catch that. Could you try typing it again?",
+            "warning": False
+        }), 400)
+
+    if len(user_message) > MAX_MESSAGE_LENGTH:
+        return None, (jsonify({
+            "reply": f"That message is a bit long. Could you keep it under {MAX_MESSAGE_LENGTH} characters?",
+            "warning": False
+        }), 400)
+
+    return user_message, None
+
+
+_timestamp_cache = (0, "")
+
+
+def _current_timestamp():
+    """ISO timestamp at second resolution, formatted at most once per second"""
+    global _timestamp_cache
+    now = int(time.time())
+    second, formatted = _timestamp_cache
+    if second != now:
+        formatted = datetime.fromtimestamp(now).isoformat()
+        _timestamp_cache = (now, formatted)
+    return formatted
+
 
 @app.route("/")
 def root():
@@ -130,30 +468,19 @@ def health_check():
     return jsonify({
         "status": "healthy",
         "service": "MindMate Backend",
-        "timestamp": datetime.now().isoformat()
+        "timestamp": _current_timestamp()
     }), 200
 
 
 @app.route("/chat", methods=["POST"])
 def chat():
-    data = request.get_json()
-
-    if not data or "message" not in data:
-        return jsonify({
-            "reply": "Please enter a message so I can help you 💙",
-            "warning": False
-        }), 400
-
-    user_message = data.get("message", "").strip()
-
-    if not user_message:
-        return jsonify({
-            "reply": "I didn’t catch that. Could you try typing it again?",
-            "warning": False
-        }), 400
+    user_message, error_response = _read_chat_message()
+    if error_response is not None:
+        return error_response
 
     distress_detected = detect_distress(user_message)
-    ai_response = call_gemini_api(user_message)
+    # Distress messages always get a fresh reply
+    ai_response = call_gemini_api(user_message, use_cache=not distress_detected)
 
     response = {
         "reply": ai_response,
@@ -168,6 +495,46 @@ def chat():
     return jsonify(response), 200
 
 
+@app.route("/chat-stream", methods=["POST"])
+def chat_stream():
+    """
+    Streaming variant of /chat using server-sent events
+    Emits an optional safety event, then {"delta": ...} events, then {"done": true}
+    If Gemini fails mid-reply, an {"error": ...} event comes before "done"
+    """
+    user_message, error_response = _read_chat_message()
+    if error_response is not None:
+        return error_response
+
+    # Distress detection runs before streaming so the safety info goes out first
+    distress_detected = detect_distress(user_message)
+
+    def generate():
+        if distress_detected:
+            safety_info = generate_safety_warning()
+            yield _sse_event({
+                "warning": True,
+                "safetyMessage": safety_info["message"],
+                "resources": safety_info["resources"]
+            })
+
+        failed = False
+        try:
+            for text in stream_gemini_api(user_message, use_cache=not distress_detected):
+                yield _sse_event({"delta": text})
+        except GeminiStreamError as e:
+            # The deltas sent so far are an incomplete reply; tell the client
+            failed = True
+            yield _sse_event({"error": str(e)})
+
+        yield _sse_event({"done": True, "warning": distress_detected, "error": failed})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 
 @app.route("/chat-history", methods=["GET"])
 def get_chat_history():
@@ -190,6 +557,15 @@ def not_found(error):
     }), 404
 
 
+@app.errorhandler(413)
+def request_too_large(error):
+    """Handle request bodies over MAX_CONTENT_LENGTH"""
+    return jsonify({
+        "error": "Request too large",
+        "status": 413
+    }), 413
+
+
 @app.errorhandler(500)
 def server_error(error):
     """Handle 500 errors"""
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 MindMate Backend Test Script
-Tests the /chat endpoint with various scenarios
+Tests the /chat and /chat-stream endpoints with various scenarios
 """
 
 import requests
@@ -75,6 +75,34 @@ def test_chat(message, user_id=TEST_USER_ID):
     except Exception as e:
         return False, {"error": str(e)}
 
+def test_chat_stream(message, user_id=TEST_USER_ID):
+    """Test streaming chat endpoint; returns the parsed SSE events"""
+    try:
+        payload = {
+            "message": message,
+            "userId": user_id
+        }
+
+        response = requests.post(
+            f"{BACKEND_URL}/chat-stream",
+            json=payload,
+            stream=True,
+            timeout=60
+        )
+
+        if response.status_code != 200:
+            return False, [response.json()]
+
+        events = []
+        for line in response.iter_lines(decode_unicode=True):
+            if line and line.startswith("data: "):
+                events.append(json.loads(line[len("data: "):]))
+        return True, events
+    except requests.exceptions.Timeout:
+        return False, [{"error": "Request timeout (Gemini API may be slow)"}]
+    except Exception as e:
+        return False, [{"error": str(e)}]
+
 def run_tests():
     """Run all tests"""
     print(f"\n{BLUE}{'='*60}{RESET}")
@@ -82,7 +110,7 @@ def run_tests():
     print(f"{BLUE}{'='*60}{RESET}\n")
     
     # Test 1: Health check
-    print_info("Test 1/5: Health Check")
+    print_info("Test 1/7: Health Check")
     health_ok = test_health()
     time.sleep(1)
     
@@ -91,7 +119,7 @@ def run_tests():
         sys.exit(1)
     
     # Test 2: Normal conversation
-    print_info("\nTest 2/5: Normal Conversation")
+    print_info("\nTest 2/7: Normal Conversation")
     print("  Sending: 'I'm feeling stressed about placements'")
     success, response = test_chat("I'm feeling stressed about placements")
     
@@ -105,7 +133,7 @@ def run_tests():
     time.sleep(1)
     
     # Test 3: Distress detection
-    print_info("\nTest 3/5: Distress Detection")
+    print_info("\nTest 3/7: Distress Detection")
     print("  Sending: 'I want to end it all'")
     success, response = test_chat("I want to end it all")
     
@@ -124,7 +152,7 @@ def run_tests():
     time.sleep(1)
     
     # Test 4: Empty message
-    print_info("\nTest 4/5: Error Handling (Empty Message)")
+    print_info("\nTest 4/7: Error Handling (Empty Message)")
     print("  Sending: '' (empty)")
     success, response = test_chat("")
     
@@ -136,7 +164,7 @@ def run_tests():
     time.sleep(1)
     
     # Test 5: Long message
-    print_info("\nTest 5/5: Error Handling (Long Message)")
+    print_info("\nTest 5/7: Error Handling (Long Message)")
     long_msg = "a" * 6000
     print(f"  Sending: {len(long_msg)} character message")
     success, response = test_chat(long_msg)
@@ -146,6 +174,48 @@ def run_tests():
     else:
         print_error("Long message should be rejected")
     
+    time.sleep(1)
+
+    # Test 6: Streaming chat with distress detection
+    print_info("\nTest 6/7: Streaming Chat (/chat-stream)")
+    print("  Sending: 'I feel hopeless'")
+    success, events = test_chat_stream("I feel hopeless")
+
+    if success and events:
+        deltas = [event["delta"] for event in events if "delta" in event]
+        if events[0].get("warning") and events[0].get("resources"):
+            print_success("Safety event sent before the reply")
+        else:
+            print_error("Expected a leading safety event for a distress message")
+        if events[-1].get("done"):
+            print_success(f"Stream completed with {len(deltas)} delta event(s)")
+            print(f"  Reply: {''.join(deltas)[:100]}...")
+            if events[-1].get("error"):
+                print_warning("Stream reported an error (Gemini may have failed mid-reply)")
+        else:
+            print_error("Stream did not end with a done event")
+    else:
+        print_error(f"Failed: {events[0].get('error', 'Unknown error') if events else 'No events received'}")
+
+    time.sleep(1)
+
+    # Test 7: Oversize request body
+    print_info("\nTest 7/7: Error Handling (Oversize Body)")
+    huge_msg = "a" * 100_000
+    print(f"  Sending: {len(huge_msg)} character body")
+    try:
+        response = requests.post(
+            f"{BACKEND_URL}/chat",
+            json={"message": huge_msg, "userId": TEST_USER_ID},
+            timeout=30
+        )
+        if response.status_code == 413 and response.json().get("status") == 413:
+            print_success(f"Oversize body rejected: {response.json().get('error')}")
+        else:
+            print_error(f"Expected 413 JSON, got status {response.status_code}")
+    except Exception as e:
+        print_error(f"Oversize body test error: {str(e)}")
+
     # Summary
     print(f"\n{BLUE}{'='*60}{RESET}")
     print_success("All tests completed!")